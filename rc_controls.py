@@ -38,6 +38,8 @@
 #      5    | Right  Trigger
 
 import pygame as pg
+import numpy as np
+from collections import deque
 from math import log
 from time import perf_counter
 from datetime import datetime
@@ -50,6 +52,23 @@ _Z_IDX = 1
 _Y_IDX = 2
 _R_IDX = 3
 
+# Slot of each held button in the vectorized held-time state.
+_KEY_SLOTS = {
+  "XM": 0,
+  "XP": 1,
+  "YM": 2,
+  "YP": 3,
+  "ZP": 4,
+  "ZM": 5,
+  "RL": 6,
+  "RR": 7
+}
+
+# Per-axis deadzones applied to the joystick state in one vectorized pass.
+_DEAD_ZONES = np.zeros(4, dtype=np.float32)
+_DEAD_ZONES[[_X_IDX, _Y_IDX, _Z_IDX]] = 0.2
+_DEAD_ZONES[_R_IDX] = 0.5
+
 
 _Xbox_Map = {
   "Type": _AXIS,
@@ -117,12 +136,21 @@ _Keyboard_Actions = {
   pg.K_l: "FLIP R"
 }
 
-def _dz_axis_clamp(d_zone: float, val: float, positive: bool=False):
-  if positive:
-    val = (val + 1)/2
-  if -d_zone < val < d_zone:
-    return 0.0
-  return val
+def _dz_axis_clamp(d_zone: float, val: float):
+  return 0.0 if abs(val) < d_zone else val
+
+_default_font_name = None
+
+# Precond:
+#   size is the point size of the desired font.
+#
+# Postcond:
+#   Returns a SysFont of the given size, caching the default font lookup.
+def default_font(size: int):
+  global _default_font_name
+  if _default_font_name is None:
+    _default_font_name = pg.font.get_default_font()
+  return pg.font.SysFont(_default_font_name, size)
 
 class RemoteControl:
   # Precond:
@@ -140,18 +168,15 @@ class RemoteControl:
     self.map = _Keyboard_Map
     self.action_map = _Keyboard_Actions
     self.stick = None
-    self.held_map = {
-      "XM": 0.0,
-      "XP": 0.0,
-      "YM": 0.0,
-      "YP": 0.0,
-      "ZP": 0.0,
-      "ZM": 0.0,
-      "RL": 0.0,
-      "RR": 0.0
-    }
-    self.__current_rc = [0, 0, 0, 0]
-    self.__action_q = []
+    self.held_map = np.zeros(len(_KEY_SLOTS), dtype=np.float32)
+    self._map_codes = [self.map[key] for key in _KEY_SLOTS]
+    self.__current_rc = np.zeros(4, dtype=np.int16)
+    self.__action_q = deque()
+    self.__quit_seen = False
+    self.__compute = self.__compute_keyboard
+    # Precompute the acceleration curve as a lookup table so the per-frame
+    # button path avoids calling log entirely.
+    self.__acc_lut = np.array([self.__acc_curve(i / 1023) for i in range(1024)], dtype=np.float32)
 
   # Precond:
   #   delta is the amount of time (in seconds) since the last call to get_rc.
@@ -159,10 +184,13 @@ class RemoteControl:
   # Postcond:
   #   Ppdates both the action queue and the rc values.
   def update(self, delta: float):
-    # Check controller change events
+    # Drain the SDL event queue once and dispatch on event type
     # Also real poor management of controllers (> 1 might break system)
-    for event in pg.event.get([pg.JOYDEVICEADDED, pg.JOYDEVICEREMOVED]):
-      if event.type == pg.JOYDEVICEADDED and self.mode == "keyboard":
+    events = pg.event.get()
+    for event in events:
+      if event.type == pg.QUIT:
+        self.__quit_seen = True
+      elif event.type == pg.JOYDEVICEADDED and self.mode == "keyboard":
         if event.device_index != 0:
           continue
         self.mode = "joystick"
@@ -171,24 +199,18 @@ class RemoteControl:
           self.stick.init()
         self.map = _Xbox_FPS_Map
         self.action_map = _Xbox_Action
+        self.__compute = self.__compute_joystick
       elif event.type == pg.JOYDEVICEREMOVED and self.mode == "joystick":
         if event.device_index != 0:
           continue
         self.mode = "keyboard"
         self.map = _Keyboard_Map
         self.action_map = _Keyboard_Actions
-        self.held_map = {
-          "XM": 0.0,
-          "XP": 0.0,
-          "YM": 0.0,
-          "YP": 0.0,
-          "ZP": 0.0,
-          "ZM": 0.0,
-          "RL": 0.0,
-          "RR": 0.0
-        }
-    self.__compute_rc(delta)
-    self.__detect_actions()
+        self.held_map.fill(0.0)
+        self._map_codes = [self.map[key] for key in _KEY_SLOTS]
+        self.__compute = self.__compute_keyboard
+    self.__compute(delta)
+    self.__detect_actions(events)
 
   # Precond:
   #   delta is the amount of time (in seconds) since the last call to get_rc.
@@ -199,6 +221,14 @@ class RemoteControl:
   def get_rc(self):
     return self.__current_rc
 
+  # Precond:
+  #   None.
+  #
+  # Postcond:
+  #   Returns True if a quit event has been seen during an update.
+  def should_quit(self):
+    return self.__quit_seen
+
   # Precond:
   #   None.
   #
@@ -206,17 +236,17 @@ class RemoteControl:
   #   Returns the next action in the queue.
   #   Returns None if there is no action in the queue.
   def next_action(self):
-    if len(self.__action_q) == 0:
+    if not self.__action_q:
       return None
-    return self.__action_q.pop(0)
+    return self.__action_q.popleft()
 
   # Precond:
-  #   None.
+  #   events is the list of events already drained from the Pygame event queue.
   #
   # Postcond:
-  #   Uses the Pygame event system to determine if buttons have been pressed to perform actions.
-  def __detect_actions(self):
-    for event in pg.event.get([pg.JOYBUTTONDOWN, pg.KEYDOWN]):
+  #   Scans the given events to determine if buttons have been pressed to perform actions.
+  def __detect_actions(self, events):
+    for event in events:
       if self.mode == "joystick" and event.type == pg.JOYBUTTONDOWN:
         if event.button in self.action_map:
           self.__action_q.append(self.action_map[event.button])
@@ -225,38 +255,54 @@ class RemoteControl:
           self.__action_q.append(self.action_map[event.key])
 
   # Precond:
-  #   delta is the amount of time (in seconds) since the last call to __compute_rc.
+  #   delta is the amount of time (in seconds) since the last update.
+  #
+  # Postcond:
+  #   Computes the current rc values from the keyboard state.
+  def __compute_keyboard(self, delta):
+    raw = np.zeros(4, dtype=np.float32)
+    # Update held button times off a single keystate fetch
+    keys = pg.key.get_pressed()
+    mask = np.fromiter((keys[code] for code in self._map_codes), dtype=bool,
+                       count=len(self._map_codes))
+    self.held_map = np.where(mask, self.held_map + delta, 0.0)
+    # Push every held time through the acceleration curve at once
+    ratio = np.clip(self.held_map / self.acc_time, 0.0, 1.0)
+    vals = self.__acc_lut[(ratio * 1023).astype(np.intp)]
+    raw[_X_IDX] = vals[_KEY_SLOTS["XP"]] - vals[_KEY_SLOTS["XM"]]
+    raw[_Y_IDX] = vals[_KEY_SLOTS["YP"]] - vals[_KEY_SLOTS["YM"]]
+    raw[_Z_IDX] = vals[_KEY_SLOTS["ZP"]] - vals[_KEY_SLOTS["ZM"]]
+    raw[_R_IDX] = vals[_KEY_SLOTS["RR"]] - vals[_KEY_SLOTS["RL"]]
+    self.__publish_rc(raw)
+
+  # Precond:
+  #   delta is the amount of time (in seconds) since the last update.
+  #
+  # Postcond:
+  #   Computes the current rc values from the joystick state.
+  def __compute_joystick(self, delta):
+    raw = np.zeros(4, dtype=np.float32)
+    raw[_X_IDX] = self.stick.get_axis(self.map["X"])
+    raw[_Y_IDX] = -self.stick.get_axis(self.map["Y"])
+    raw[_Z_IDX] = -self.stick.get_axis(self.map["Z"])
+    if "R" in self.map:
+      raw[_R_IDX] = self.stick.get_axis(self.map["R"])
+    # Apply the per-axis deadzones in a single vectorized pass
+    raw = np.where(np.abs(raw) < _DEAD_ZONES, 0.0, raw)
+    if "R" not in self.map:
+      # Triggers rest at -1, so rescale to [0, 1] before the deadzone
+      rr_val = _dz_axis_clamp(0.5, (self.stick.get_axis(self.map["RR"]) + 1) / 2)
+      rl_val = _dz_axis_clamp(0.5, (self.stick.get_axis(self.map["RL"]) + 1) / 2)
+      raw[_R_IDX] = (rr_val - rl_val)
+    self.__publish_rc(raw)
+
+  # Precond:
+  #   raw is the 4 element float array of raw axis values.
   #
   # Postcond:
-  #   Computes the current rc values based on key/controller inputs.
-  def __compute_rc(self, delta):
-    # Init the rc state
-    rc_state = [0, 0, 0, 0]
-    if self.map["Type"] == _BUTTON:
-      # Decrease held button counts
-      for key in self.held_map:
-        if pg.key.get_pressed()[self.map[key]]:
-          self.held_map[key] += delta
-        else:
-          self.held_map[key] = 0 #max(0.0, (self.held_map[key] - 2*delta))
-        rc_state[_X_IDX] = self.__btn_acc_curve(self.held_map["XP"]) - self.__btn_acc_curve(self.held_map["XM"])
-        rc_state[_Y_IDX] = self.__btn_acc_curve(self.held_map["YP"]) - self.__btn_acc_curve(self.held_map["YM"])
-        rc_state[_Z_IDX] = self.__btn_acc_curve(self.held_map["ZP"]) - self.__btn_acc_curve(self.held_map["ZM"])
-        rc_state[_R_IDX] = self.__btn_acc_curve(self.held_map["RR"]) - self.__btn_acc_curve(self.held_map["RL"])
-    elif self.map["Type"] == _AXIS:
-      rc_state[_X_IDX] = _dz_axis_clamp(0.2, self.stick.get_axis(self.map["X"]))
-      rc_state[_Y_IDX] = -_dz_axis_clamp(0.2, self.stick.get_axis(self.map["Y"]))
-      rc_state[_Z_IDX] = -_dz_axis_clamp(0.2, self.stick.get_axis(self.map["Z"]))
-      if "R" in self.map:
-        rc_state[_R_IDX] = _dz_axis_clamp(0.5, self.stick.get_axis(self.map["R"]))
-      else:
-        rr_val = _dz_axis_clamp(0.5, self.stick.get_axis(self.map["RR"]), True)
-        rl_val = _dz_axis_clamp(0.5, self.stick.get_axis(self.map["RL"]), True)
-        rc_state[_R_IDX] = (rr_val - rl_val)
-    # Align the rc_state with api expectations
-    for i in range(len(rc_state)):
-      rc_state[i] = max(-100, min(100, int(100 * rc_state[i])))
-    self.__current_rc = rc_state
+  #   Aligns the raw state with api expectations and publishes it.
+  def __publish_rc(self, raw):
+    self.__current_rc = np.clip(np.rint(raw * 100.0), -100, 100).astype(np.int16)
 
   # Precond:
   #   t is the number of seconds a button has been held.
@@ -266,7 +312,7 @@ class RemoteControl:
   def __btn_acc_curve(self, t):
     # Clamp the time
     t = max(0, min(t, self.acc_time)) / self.acc_time
-    return self.__acc_curve(t)
+    return self.__acc_lut[int(t * 1023)]
 
 
   # Precond:
@@ -274,6 +320,7 @@ class RemoteControl:
   #
   # Postcond:
   #   Returns a number between 0 and 1 indicating the current speed associated with the acc curve.
+  #   Only used to build the lookup table consulted by __btn_acc_curve.
   def __acc_curve(self, t):
     neg = -1 if t < 0 else 1
     t = abs(t)
@@ -288,7 +335,7 @@ def _main():
   for item in _Keyboard_Map:
     key_name = pg.key.name(_Keyboard_Map[item])
     if key_name:
-      print(pg.key.name(_Keyboard_Map[item]), "->", _KEYMAP_EXPAND[item])
+      print(key_name, "->", _KEYMAP_EXPAND[item])
     else:
       print(item, "->", _KEYMAP_EXPAND[item])
   for item in _Keyboard_Actions:
@@ -299,7 +346,7 @@ def _main():
   # Test the controls
   pg.init()
   screen = pg.display.set_mode((500, 250))
-  font = pg.font.SysFont(pg.font.get_default_font(), 48)
+  font = default_font(48)
   padding = 20
   fps = 30
   frame_delta = 1/fps
@@ -309,6 +356,16 @@ def _main():
   r_text = font.render("R:", True, (255,255,255))
   pos_color = (0, 200, 0)
   neg_color = (200, 0, 0)
+  # Compose the static labels onto one background layer and remember where
+  # each axis bar starts
+  labels_layer = pg.Surface((500, 250))
+  labels_layer.fill((0, 0, 0))
+  bar_anchors = []
+  vert_pos = padding
+  for text in (x_text, y_text, z_text, r_text):
+    labels_layer.blit(text, (padding, vert_pos))
+    bar_anchors.append((2 * padding + text.get_width(), vert_pos, text.get_height()))
+    vert_pos += text.get_height() + padding
   # Setup controller
   controller = RemoteControl(10, 2)
   running = True
@@ -318,45 +375,14 @@ def _main():
     if delta >= frame_delta:
       start = perf_counter()
       controller.update(frame_delta)
-      screen.fill((0, 0, 0))
-      for event in pg.event.get(pg.QUIT):
+      if controller.should_quit():
         running = False
       rc_data = controller.get_rc()
-      # Display active x value
-      vert_pos = padding
-      horz_pos = 2 * padding + x_text.get_width()
-      screen.blit(x_text, (padding, vert_pos))
-      color = pos_color
-      if rc_data[_X_IDX] < 0:
-        color = neg_color
-      pg.draw.rect(screen, color, (horz_pos, vert_pos, abs(rc_data[_X_IDX]), x_text.get_height()))
-
-      # Display active y value
-      vert_pos += x_text.get_height() + padding
-      horz_pos = 2 * padding + y_text.get_width()
-      screen.blit(y_text, (padding, vert_pos))
-      color = pos_color
-      if rc_data[_Y_IDX] < 0:
-        color = neg_color
-      pg.draw.rect(screen, color, (horz_pos, vert_pos, abs(rc_data[_Y_IDX]), y_text.get_height()))
-
-      # Display active z value
-      vert_pos += y_text.get_height() + padding
-      horz_pos = 2 * padding + z_text.get_width()
-      screen.blit(z_text, (padding, vert_pos))
-      color = pos_color
-      if rc_data[_Z_IDX] < 0:
-        color = neg_color
-      pg.draw.rect(screen, color, (horz_pos, vert_pos, abs(rc_data[_Z_IDX]), z_text.get_height()))
-
-      # Display active r value
-      vert_pos += z_text.get_height() + padding
-      horz_pos = 2 * padding + x_text.get_width()
-      screen.blit(r_text, (padding, vert_pos))
-      color = pos_color
-      if rc_data[_R_IDX] < 0:
-        color = neg_color
-      pg.draw.rect(screen, color, (horz_pos, vert_pos, abs(rc_data[_R_IDX]), r_text.get_height()))
+      # Blit the static layer, then draw only the active axis bars
+      screen.blit(labels_layer, (0, 0))
+      for idx, (horz_pos, vert_pos, height) in zip((_X_IDX, _Y_IDX, _Z_IDX, _R_IDX), bar_anchors):
+        color = neg_color if rc_data[idx] < 0 else pos_color
+        pg.draw.rect(screen, color, (horz_pos, vert_pos, abs(rc_data[idx]), height))
 
       pg.display.flip()
 
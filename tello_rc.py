@@ -15,14 +15,20 @@
 #   A class for handling a tello drone using keyboard/controller controls.
 # Notes:
 
-from threading import Thread
+from threading import Thread, Event, Lock
 from socket import socket, AF_INET, SOCK_DGRAM
 from time import perf_counter, sleep
-from rc_controls import RemoteControl
+from rc_controls import RemoteControl, default_font
 import pygame as pg
 import cv2 as cv
 from datetime import datetime
+import os
 import random
+import re
+import selectors
+
+# Pulls label:value pairs out of a raw Tello state datagram.
+_STATE_RE = re.compile(rb'([a-z0-9]+):(-?[\d.]+)')
 
 class TelloRC:
   # Precond:
@@ -44,12 +50,22 @@ class TelloRC:
     self.state_channel = socket(AF_INET, SOCK_DGRAM)
     self.state_channel.bind(('', self.state_port))
 
+    # Self-pipe used to wake the receive thread on shutdown
+    self._wake_r, self._wake_w = os.pipe()
+
+    # Preallocated datagram buffers, one per receiving thread
+    self._cmd_rx_buf = bytearray(1024)
+    self._cmd_rx_mv = memoryview(self._cmd_rx_buf)
+    self._state_rx_buf = bytearray(1024)
+    self._state_rx_mv = memoryview(self._state_rx_buf)
+
     # Video setup
     self.video_connect_str = 'udp://' + self.tello_addr + ":" + str(self.video_port)
     self.video_stream = None
     self.video_thread = Thread(target=self.__receive_video)
     self.video_thread.daemon = True
     self.last_frame = None
+    self.frame_pub = None
     self.stream_active = False
     self.frame_width = 0
     self.frame_height = 0
@@ -60,12 +76,11 @@ class TelloRC:
     self.connected = False
     self.rc_freq = 30
     self.cmd_log = []
+    self.cmd_lock = Lock()
     self.last_state = None
     self.MAX_TIMEOUT = 5
 
     # Threads
-    self.send_thread = Thread(target=self.__send_rc)
-    self.send_thread.daemon = True
     self.receive_thread = Thread(target=self.__receive)
     self.receive_thread.daemon = True
     self.state_thread = Thread(target=self.__receive_state)
@@ -113,7 +128,7 @@ class TelloRC:
   #   None.
   #
   # Postcond:
-  #   Returns the last received state as a dictionary.
+  #   Returns the last received state as a dictionary of raw bytes fields.
   def get_state(self):
     return self.last_state
 
@@ -133,85 +148,79 @@ class TelloRC:
     run_timer = perf_counter()
     frame_delta = 1/30
     # Helpful text
-    font = pg.font.SysFont(pg.font.get_default_font(), 48)
+    font = default_font(48)
     takeoff_txt = font.render("TAKING OFF", True, (255, 255, 255), (0, 0, 0))
     landing_txt = font.render("LANDING", True, (255, 255, 255), (0, 0, 0))
     pic_txt = font.render("TAKING PICTURE", True, (255, 255, 255), (0, 0, 0))
     stop_txt = font.render("SHUTTING DOWN", True, (255, 255, 255), (0, 0, 0))
     flip_txt = font.render("FLIPPING", True, (255, 255, 255), (0, 0, 0))
     bat_color = (0, 200, 0)
+    # Pre-render the static battery gauge outline
+    battery_bg = pg.Surface((108, 58))
+    pg.draw.rect(battery_bg, (255, 255, 255), (0, 0, 108, 58))
+    pg.draw.rect(battery_bg, (0, 0, 0), (2, 2, 104, 54))
     # Setup screen
     if not pg.get_init():
       pg.init()
     screen_dim = (1280, 720) if self.last_frame is None else (self.frame_width, self.frame_height)
     screen = pg.display.set_mode(screen_dim)
     while running:
-      delta = perf_counter() - run_timer
-      if delta >= frame_delta:
-        for event in pg.event.get(pg.QUIT):
-          running = False
-        control.update(frame_delta) #make sure we don't spike anything
-        self.__send_rc(control.get_rc())
-        action = control.next_action()
-        # Draw last frame grabbed
-        screen.fill((200, 200, 200))
-        if self.last_frame is not None:
-          screen.blit(pg.image.frombuffer(self.last_frame.tobytes(), self.last_frame.shape[1::-1], "BGR"), (0, 0))
-        # Check state and render battery life
-        if self.last_state is not None:
-          percentage = int(self.last_state['bat'])
-          if percentage <= 30:
-            bat_color = (200, 0, 0)
-          # Draw bounding boxes
-          pg.draw.rect(screen, (255, 255, 255), (0, 0, 108, 58))
-          pg.draw.rect(screen, (0, 0, 0), (2, 2, 104, 54))
-          pg.draw.rect(screen, bat_color, (4, 4, percentage, 50))
-        if action is not None:
-          match action:
-            case "TAKEOFF":
-              if not self.flying:
-                center_x = (screen.get_width() - takeoff_txt.get_width())//2
-                center_y = (screen.get_height() - takeoff_txt.get_height())//2
-                screen.blit(takeoff_txt, (center_x, center_y))
-              else:
-                center_x = (screen.get_width() - landing_txt.get_width())//2
-                center_y = (screen.get_height() - landing_txt.get_height())//2
-                screen.blit(landing_txt, (center_x, center_y))
-            case "PICTURE":
-              center_x = (screen.get_width() - pic_txt.get_width())//2
-              center_y = (screen.get_height() - pic_txt.get_height())//2
-              screen.blit(pic_txt, (center_x, center_y))
-            case "FLIP F" | "FLIP B" | "FLIP L" | "FLIP R":
-              if self.flying:
-                center_x = (screen.get_width() - flip_txt.get_width())//2
-                center_y = (screen.get_height() - flip_txt.get_height())//2
-                screen.blit(flip_txt, (center_x, center_y))
-            case "STOP":
-              center_x = (screen.get_width() - stop_txt.get_width())//2
-              center_y = (screen.get_height() - stop_txt.get_height())//2
-              screen.blit(stop_txt, (center_x, center_y))
-            case _:
-              pass
-        pg.display.flip()
-        if action is not None:
-          match action:
-            case "TAKEOFF":
-              if not self.flying:
-                self.__send_cmd("takeoff")
-              else:
-                self.__send_cmd("land")
-              self.flying = not self.flying
-            case "PICTURE":
-              date = datetime.today().strftime("%b-%d-%y")
-              filename = "pic_" + date + f"-{random.randint(1,10**6)}.jpg"
-              cv.imwrite(filename, self.last_frame)
-            case "FLIP F" | "FLIP B" | "FLIP L" | "FLIP R":
-              if self.flying:
-                self.__send_cmd(action.lower())
-            case "STOP":
-              running = False
-            case _:
-              print("Unknown action:", action)
+      # Sleep off the remainder of the frame instead of spinning
+      remaining = frame_delta - (perf_counter() - run_timer)
+      if remaining > 0:
+        sleep(remaining)
+      run_timer = perf_counter()
+      control.update(frame_delta) #make sure we don't spike anything
+      if control.should_quit():
+        running = False
+      self.__send_rc(control.get_rc())
+      action = control.next_action()
+      # Single dispatch: issue the action command (before rendering, so the
+      # drone isn't waiting on draw calls) and pick the overlay text.
+      overlay = None
+      if action is not None:
+        match action:
+          case "TAKEOFF":
+            if not self.flying:
+              overlay = takeoff_txt
+              self.__send_cmd("takeoff")
+            else:
+              overlay = landing_txt
+              self.__send_cmd("land")
+            self.flying = not self.flying
+          case "PICTURE":
+            overlay = pic_txt
+            date = datetime.today().strftime("%b-%d-%y")
+            filename = "pic_" + date + f"-{random.randint(1,10**6)}.jpg"
+            cv.imwrite(filename, self.last_frame)
+          case "FLIP F" | "FLIP B" | "FLIP L" | "FLIP R":
+            if self.flying:
+              overlay = flip_txt
+              self.__send_cmd(action.lower())
+          case "STOP":
+            overlay = stop_txt
+            running = False
+          case _:
+            print("Unknown action:", action)
+      # Draw last frame grabbed
+      screen.fill((200, 200, 200))
+      frame_pub = self.frame_pub
+      if frame_pub is not None:
+        screen.blit(pg.image.frombuffer(frame_pub[0], frame_pub[1], "RGB"), (0, 0))
+      # Check state and render battery life
+      if self.last_state is not None:
+        percentage = int(self.last_state[b'bat'])
+        if percentage <= 30:
+          bat_color = (200, 0, 0)
+        # Blit the cached outline and draw only the fill level
+        screen.blit(battery_bg, (0, 0))
+        pg.draw.rect(screen, bat_color, (4, 4, percentage, 50))
+      if overlay is not None:
+        screen_w, screen_h = screen.get_size()
+        center_x = (screen_w - overlay.get_width())//2
+        center_y = (screen_h - overlay.get_height())//2
+        screen.blit(overlay, (center_x, center_y))
+      pg.display.flip()
     self.shutdown()
 
 
@@ -226,10 +235,11 @@ class TelloRC:
         self.__send_cmd("land")
       self.active = False
       self.stream_active = False
+      os.write(self._wake_w, b'x')
+      self.receive_thread.join()
       self.send_channel.close()
       self.last_frame = None
-      sleep(1)
-      self.receive_thread.join()
+      self.frame_pub = None
       self.video_thread.join()
       pg.quit()
 
@@ -260,8 +270,8 @@ class TelloRC:
   # Postcond:
   #   Sends the provided rc_values to the drone.
   def __send_rc(self, rc_val: [int, int, int, int]):
-    rc_str = "rc " + " ".join(list(map(str, rc_val)))
-    self.__send_nowait(rc_str)
+    rc_msg = b"rc %d %d %d %d" % (rc_val[0], rc_val[1], rc_val[2], rc_val[3])
+    self.send_channel.sendto(rc_msg, (self.tello_addr, self.cmd_port))
 
   # Precond:
   #   msg is a string containing the message to send.
@@ -271,15 +281,15 @@ class TelloRC:
   #   Returns the response string if the message was received.
   #   Returns None if the message failed.
   def __send_cmd(self, msg: str):
-    self.cmd_log.append([msg, None])
+    entry = [msg, None, Event()]
+    with self.cmd_lock:
+      self.cmd_log.append(entry)
     self.send_channel.sendto(msg.encode('utf-8'), (self.tello_addr, self.cmd_port))
-    # Response wait loop
-    start = perf_counter()
-    while self.cmd_log[-1][1] is None:
-      if (perf_counter() - start) > self.MAX_TIMEOUT:
-        self.cmd_log[-1][1] = "TIMED OUT"
-        return None
-    return self.cmd_log[-1][1]
+    # Block until the receive thread flags a response (or we time out)
+    if not entry[2].wait(self.MAX_TIMEOUT):
+      entry[1] = "TIMED OUT"
+      return None
+    return entry[1]
 
   # Precond:
   #   msg is a string containing the message to send.
@@ -298,18 +308,41 @@ class TelloRC:
   # Postcond:
   #   Receives messages from the Tello and logs them.
   def __receive(self):
-    while self.active:
-      try:
-        response, ip = self.send_channel.recvfrom(1024)
-        response = response.decode('utf-8')
-        self.cmd_log[-1][1] = response.strip()
-      except OSError as exc:
-        if self.active:
-          print("Caught exception socket.error : %s" % exc)
-      except UnicodeDecodeError as _:
-        if self.active:
-          self.cmd_log[-1][1] = "Decode Error"
-          print("Caught exception Unicode 0xcc error.")
+    # Block on both the command socket and the shutdown pipe so shutdown
+    # can wake this thread without waiting on a socket timeout.
+    sel = selectors.DefaultSelector()
+    sel.register(self.send_channel, selectors.EVENT_READ)
+    sel.register(self._wake_r, selectors.EVENT_READ)
+    try:
+      while self.active:
+        for key, _ in sel.select():
+          if key.fileobj is self._wake_r:
+            return
+          try:
+            n, ip = self.send_channel.recvfrom_into(self._cmd_rx_buf)
+            response = str(self._cmd_rx_mv[:n], 'utf-8')
+            self.__resolve_cmd(response.strip())
+          except OSError as exc:
+            if self.active:
+              print("Caught exception socket.error : %s" % exc)
+          except UnicodeDecodeError as _:
+            if self.active:
+              self.__resolve_cmd("Decode Error")
+              print("Caught exception Unicode 0xcc error.")
+    finally:
+      sel.close()
+
+  # Precond:
+  #   response is the response string to log.
+  #
+  # Postcond:
+  #   Records the response against the most recent command and wakes its sender.
+  def __resolve_cmd(self, response: str):
+    with self.cmd_lock:
+      entry = self.cmd_log[-1] if self.cmd_log else None
+    if entry is not None:
+      entry[1] = response
+      entry[2].set()
 
   # Precond:
   #   None.
@@ -321,6 +354,10 @@ class TelloRC:
       ret, img = self.video_stream.read()
       if ret:
         self.last_frame = img
+        # Swizzle and serialize once here so the render loop can blit the
+        # published buffer without another full-frame copy.
+        rgb = cv.cvtColor(img, cv.COLOR_BGR2RGB)
+        self.frame_pub = (rgb.tobytes(), img.shape[1::-1])
     self.video_stream.release()
 
   # Precond:
@@ -331,24 +368,11 @@ class TelloRC:
   def __receive_state(self):
     while self.active:
       try:
-        response, ip = self.state_channel.recvfrom(1024)
-        response = response.decode('utf-8')
-        response = response.strip()
-        vals = response.split(';')
-        state = {}
-        for item in vals:
-            if item == '':
-                continue
-            label, val = item.split(':')
-            state[label] = val
-        self.last_state = state
+        n, ip = self.state_channel.recvfrom_into(self._state_rx_buf)
+        self.last_state = dict(_STATE_RE.findall(self._state_rx_mv[:n]))
       except OSError as exc:
         if self.active:
           print("Caught exception socket.error : %s" % exc)
-      except UnicodeDecodeError as _:
-        if self.active:
-          self.cmd_log[-1][1] = "Decode Error"
-          print("Caught exception Unicode 0xcc error.")
 
 if __name__ == "__main__":
   drone = TelloRC()